@@ -0,0 +1,18 @@
+"""
+Celery application for the backend project.
+
+Workers are started with ``celery -A backend worker`` and pick up every
+``@shared_task`` declared in the installed apps' ``tasks.py`` modules.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+app = Celery('backend')
+
+# Read every CELERY_* setting from Django's settings module
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -155,4 +155,39 @@ REDDIT_USER_AGENT = os.getenv('REDDIT_USER_AGENT', 'RedditInsightAgent/1.0')
 
 # Google Gemini API Configuration
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-GOOGLE_GEMINI_MODEL = os.getenv('GOOGLE_GEMINI_MODEL', 'gemini-2.5-flash')  # Default to latest stable model
\ No newline at end of file
+GOOGLE_GEMINI_MODEL = os.getenv('GOOGLE_GEMINI_MODEL', 'gemini-2.5-flash')  # Default to latest stable model
+
+# Embedding Configuration
+# 'onnx' runs an int8-quantized export through ONNX Runtime (CPU); 'torch' runs the PyTorch model
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'onnx')
+# CPU inference precision for MiniLM ('bfloat16' or 'float32'); CUDA always uses float16.
+# Unset picks bfloat16 only on CPUs with native BF16 kernels (AVX512-BF16/AMX), float32 elsewhere
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', '')
+# Coalesce concurrent embedding calls into shared batches (torch backend; most useful on a GPU).
+# Needs the optional 'batched' package
+EMBEDDING_DYNAMIC_BATCHING = os.getenv('EMBEDDING_DYNAMIC_BATCHING', 'false').lower() == 'true'
+EMBEDDING_BATCH_TIMEOUT_MS = float(os.getenv('EMBEDDING_BATCH_TIMEOUT_MS', '10'))
+# Intra-op threads per worker process for PyTorch and ONNX Runtime; roughly physical cores / number of workers
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', '4'))
+
+# ChromaDB Configuration
+# Set CHROMA_HOST to use a Chroma server (see docker-compose.yml); leave unset for the embedded store in chroma_db/
+CHROMA_HOST = os.getenv('CHROMA_HOST')
+CHROMA_PORT = int(os.getenv('CHROMA_PORT', '8000'))
+
+
+# Shared cache (Redis). Holds the per-document / per-post vector-store versions that key the
+# retrieval cache, so writes in the Celery worker invalidate cached results in web processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_URL', 'redis://localhost:6379/1'),
+    }
+}
+
+
+# Celery Configuration (background RAG ingestion)
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class TasksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tasks'
+
+    def ready(self):
+        import torch
+
+        # Cap intra-op threads per process: with several gunicorn/Celery workers on one
+        # host, PyTorch's default (one thread per core in every process) over-subscribes the CPU
+        torch.set_num_threads(settings.TORCH_NUM_THREADS)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set once, before any inter-op work has started (e.g. on autoreload)
+            pass
@@ -5,4 +5,4 @@ class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
         fields = '__all__'
-        read_only_fields = ('is_indexed',) # I should NOT let fronend set this
\ No newline at end of file
+        read_only_fields = ('is_indexed', 'indexing_error') # I should NOT let fronend set this
\ No newline at end of file
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from tasks.vector_service import ONNX_MODEL_DIR, export_quantized_onnx
+
+
+class Command(BaseCommand):
+    help = "Exports, optimizes and int8-quantizes the MiniLM embedding model for the ONNX backend (run at deploy time)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Rebuild even if an export already exists")
+
+    def handle(self, *args, **options):
+        if export_quantized_onnx(force=options["force"]):
+            self.stdout.write(self.style.SUCCESS(f"Exported quantized ONNX model to {ONNX_MODEL_DIR}"))
+        else:
+            self.stdout.write(f"ONNX model already exists in {ONNX_MODEL_DIR} (use --force to rebuild)")
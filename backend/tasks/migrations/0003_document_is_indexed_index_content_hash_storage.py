@@ -0,0 +1,24 @@
+# Generated by Django 4.2.4 on 2026-10-15 12:00
+
+from django.db import migrations, models
+import tasks.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0002_delete_task'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='is_indexed',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='uploaded_file',
+            field=models.FileField(storage=tasks.storage.ContentHashStorage(), upload_to='documents/'),
+        ),
+    ]
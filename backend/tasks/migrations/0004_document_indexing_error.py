@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-15 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0003_document_is_indexed_index_content_hash_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='indexing_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -1,13 +1,18 @@
 from django.db import models
 
+from .storage import ContentHashStorage
+
 
 class Document(models.Model):
     title = models.CharField(max_length=255)
     # FileField is key: 'documents/' is a subfolder inside MEDIA_ROOT
-    uploaded_file=models.FileField(upload_to='documents/')
+    # Files are named after a hash of their content, so duplicate uploads dedupe on disk
+    uploaded_file=models.FileField(upload_to='documents/', storage=ContentHashStorage())
 
-    # We will use this flag later to track if the RAG indexing is done
-    is_indexed = models.BooleanField(default=False)
+    # Set by the background indexing task; indexed so "pending to index" lookups avoid a table scan
+    is_indexed = models.BooleanField(default=False, db_index=True)
+    # Why the background indexing failed (e.g. a scanned PDF with no text layer); empty otherwise
+    indexing_error = models.TextField(blank=True, default='')
 
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -1,25 +1,126 @@
-import os
-
+from collections import Counter
+from functools import lru_cache
 
+import fitz  # PyMuPDF
+from langchain_core.documents import Document
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 # from langchain_community.embeddings import HuggingFaceEmbeddings # <-- NEW Import
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
 from django.conf import settings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 # from langchain.text_splitter import RecursiveCharacterTextSplitter # pyright: ignore[reportMissingImports]
-from langchain_community.document_loaders import UnstructuredPDFLoader
-from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.vectorstores.utils import filter_complex_metadata
 from langchain_ollama import OllamaLLM
 
+from .vector_service import add_documents, chunk_id, copy_chunks, get_tokenizer, search
+
+
+# Chunking parameters, measured in MiniLM tokens so every chunk fits the
+# encoder's 256 word-piece window (leaving room for [CLS]/[SEP]) and nothing is truncated
+CHUNK_SIZE = 220
+CHUNK_OVERLAP = 30
 
+# A span counts as a heading when its font is at least this much larger than the body text
+HEADING_SIZE_RATIO = 1.15
+# ...and its size is in the top percentile of all sizes used in the document
+HEADING_SIZE_PERCENTILE = 0.9
+# Two same-size heading lines are one wrapped heading when the vertical gap between them
+# is at most this fraction of the font size (separate headings have paragraph spacing)
+HEADING_WRAP_GAP = 0.5
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def load_pdf_sections(file_path: str) -> list[Document]:
+    """
+    Heuristic (model-free) PDF parser.
+    Reads text spans with their font sizes via PyMuPDF, treats unusually large fonts
+    as headings, and emits one Document per section with its heading path as metadata.
+    """
+    lines = []  # (font_size, text, page_number, top, bottom)
+    with fitz.open(file_path) as pdf:
+        for page_number, page in enumerate(pdf, start=1):
+            for block in page.get_text("dict")["blocks"]:
+                # type 0 == text block (images are type 1)
+                if block.get("type") != 0:
+                    continue
+                for line in block["lines"]:
+                    text = "".join(span["text"] for span in line["spans"]).strip()
+                    if not text:
+                        continue
+                    size = max(round(span["size"], 1) for span in line["spans"])
+                    lines.append((size, text, page_number, line["bbox"][1], line["bbox"][3]))
+
+    if not lines:
+        return []
+
+    # The body font is the size that carries the most characters
+    size_weights = Counter()
+    for size, text, *_ in lines:
+        size_weights[size] += len(text)
+    body_size = size_weights.most_common(1)[0][0]
+    heading_floor = max(body_size * HEADING_SIZE_RATIO, _percentile([line[0] for line in lines], HEADING_SIZE_PERCENTILE))
+
+    # Larger headings sit higher in the hierarchy; a new heading closes any open heading of equal or smaller size
+    heading_stack = []  # (font_size, heading_text)
+    sections = []
+    body_lines = []
+    section_page = 1
+    heading_pending = False  # The innermost heading has not been emitted in any section yet
+    last_heading_line = None  # (font_size, page_number, bottom) of the previous line, if it was a heading
+
+    def flush():
+        nonlocal heading_pending
+        if body_lines or heading_pending:
+            section = " > ".join(text for _, text in heading_stack)
+            # The heading path leads the text, so titles are embedded and reach the LLM too
+            sections.append(Document(
+                page_content="\n".join(([section] if section else []) + body_lines),
+                metadata={
+                    "source": file_path,
+                    "page": section_page,
+                    "section": section,
+                },
+            ))
+            body_lines.clear()
+            heading_pending = False
+
+    for size, text, page_number, top, bottom in lines:
+        if size >= heading_floor:
+            if (
+                last_heading_line is not None
+                and last_heading_line[:2] == (size, page_number)
+                and top - last_heading_line[2] <= size * HEADING_WRAP_GAP
+            ):
+                # Wrapped title: the next line of the same heading, keep it together
+                heading_stack[-1] = (size, f"{heading_stack[-1][1]} {text}")
+                last_heading_line = (size, page_number, bottom)
+                continue
+            # Emit the open section, or a heading that is about to be closed before any body
+            if body_lines or (heading_pending and heading_stack[-1][0] <= size):
+                flush()
+            while heading_stack and heading_stack[-1][0] <= size:
+                heading_stack.pop()
+            heading_stack.append((size, text))
+            section_page = page_number
+            heading_pending = True
+            last_heading_line = (size, page_number, bottom)
+        else:
+            if not body_lines:
+                section_page = page_number
+            body_lines.append(text)
+            last_heading_line = None
+    flush()
+
+    return sections
+
+
+def _document_chunk_id(doc_id: int, text: str) -> str:
+    return chunk_id(f"doc_{doc_id}:{text}")
 
-# This directory will store your ChromaDB files
-CHROMA_DB_PATH = os.path.join(settings.BASE_DIR, "chroma_db")
 
 def index_document(document_instance):
     """
@@ -30,49 +131,46 @@ def index_document(document_instance):
     file_path = document_instance.uploaded_file.path
 
     # --- 1. Load and Parse ---
-    # Using UnstructuredPDFLoader for pdfs that can contain ustructured combinations oftables, objects, credentials, etc.
-    # than PyPDFLoader. Let's try this:
-    loader = UnstructuredPDFLoader(file_path, mode="elements", strategy="hi_res")
-    documents = loader.load()
-
-    # Debug: inspect raw loader output before any splitting to verify extraction
-    print("Loaded documents:", documents)
-
-    # NEW: Filter out complex metadata before chunking/splitting
-    documents = filter_complex_metadata(documents)
+    # Heuristic PyMuPDF parser: recovers the heading structure from font sizes
+    # without running any layout-detection model, so parsing stays cheap on CPU
+    documents = load_pdf_sections(file_path)
+    if not documents:
+        # No text layer (e.g. a scanned PDF) - there is nothing to index without OCR
+        raise ValueError(f"No extractable text found in {file_path}")
+    print(f"Parsed {len(documents)} sections from {file_path}")
 
 
     # --- 2. Chunking (Splitting) ---
     # Interview Focus: Chunking is vital for context. 
-    # Small chunks (e.g., 500) prevent hitting LLM token limits.
-    # Overlap (e.g., 50) helps maintain context across chunks.
-    # Smaller chunks with higher overlap to keep resume sections cohesive across boundaries
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500, 
-        chunk_overlap=150,
-        length_function=len
+    # Small chunks prevent hitting LLM token limits.
+    # Overlap helps maintain context across chunks.
+    # Sizes are counted with the embedding model's own (cached) tokenizer
+    tokenizer = get_tokenizer()
+    text_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        chunk_size=CHUNK_SIZE, 
+        chunk_overlap=CHUNK_OVERLAP,
     )
 
-    chunks = text_splitter.split_documents(documents)
-    print(f"Split {len(documents)} pages into {len(chunks)} chunks.")
+    # Sections that already fit in one chunk are kept whole
+    chunks = []
+    for section in documents:
+        if len(tokenizer.tokenize(section.page_content)) <= CHUNK_SIZE:
+            chunks.append(section)
+        else:
+            chunks.extend(text_splitter.split_documents([section]))
+    print(f"Split {len(documents)} sections into {len(chunks)} chunks.")
 
-    # --- 3. Embedding ---
+    # --- 3. Embedding + 4. Storage in Vector Database ---
     # We use the OpenAI model for conversion (Text -> Vector)
     # RUNNING OUT OF TOKEN. SWITCHED TO HUGGINGFACE EMBEDDINGS  
     # embeddings = OpenAIEmbeddings() # type: ignore
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-
-    # --- 4. Storage in Vector Database ---
-    # We use the document's ID as the collection name to isolate its vectors
-    collection_name = f"doc_{document_instance.id}"
-
-    # This creates/loads the vector store and adds the documents
-    Chroma.from_documents(
-        chunks, 
-        embeddings, 
-        collection_name=collection_name, 
-        persist_directory=CHROMA_DB_PATH
-    )
+    # All chunks are embedded up front, then written to the shared collection
+    # Every chunk is tagged with the document's ID, which isolates its vectors at query time
+    for chunk in chunks:
+        chunk.metadata["doc_id"] = document_instance.id
+    ids = [_document_chunk_id(document_instance.id, chunk.page_content) for chunk in chunks]
+    add_documents(chunks, ids)
 
     # Final step: Mark the document as indexed
     document_instance.is_indexed = True
@@ -82,38 +180,32 @@ def index_document(document_instance):
 
     return len(chunks)
 
-def query_document(document_id: int, query: str) -> str:
+
+def reuse_document_index(source_doc_id: int, document_instance):
     """
-    Builds and invokes an LCEL chain for RAG retrieval and generation.
+    Indexes an upload whose bytes match an already-indexed Document (ContentHashStorage
+    gave both the same file) by copying that document's chunks and vectors under the
+    new doc_id, so the PDF is neither parsed nor embedded again.
+    Falls back to the full pipeline if the source's chunks are gone.
     """
-    # 1. Initialize Components
-    # (CURRENTLY RAN OUT OF TOKEN. SWITCHED TO LOCAL EMBEDDING FROM HUGGINGFACE)
-    # embeddings = OpenAIEmbeddings()
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    collection_name = f"doc_{document_id}"
-
-    # 2. Load the Vector Store and Create the Retriever
-    vectorstore = Chroma(
-        collection_name=collection_name, 
-        embedding_function=embeddings, 
-        persist_directory=CHROMA_DB_PATH
+    copied = copy_chunks(
+        {"doc_id": source_doc_id},
+        {"doc_id": document_instance.id},
+        lambda text: _document_chunk_id(document_instance.id, text),
     )
+    if not copied:
+        return index_document(document_instance)
 
-    # The retriever object handles the semantic search (Retrieval)
-    # Retrieve more chunks and use MMR for diverse, relevant results
-    retriever = vectorstore.as_retriever(
-        search_type="mmr", 
-        search_kwargs={"k": 8} # Retrieve top 8 with diversity
-    )
+    document_instance.is_indexed = True
+    document_instance.save()
+
+    print(f"Reused {copied} chunks of Document ID {source_doc_id} for Document ID: {document_instance.id}")
+
+    return copied
 
-    # 3. Define the LLM (The Generator)
-    llm = OllamaLLM(
-        model="llama2", # <-- The model name you ran in the terminal
-        temperature=0.0
-    )
 
-    # 4. Define the Prompt (Crucial for Contextualization)
-    template = """
+# Prompt for document Q&A (Crucial for Contextualization)
+DOCUMENT_PROMPT = ChatPromptTemplate.from_template("""
     You are an assistant for question-answering based on the provided document context.
     Use the following retrieved context to answer the user's question concisely.
     If the context does not contain the answer, state that you cannot find the answer in the provided documents.
@@ -121,30 +213,42 @@ def query_document(document_id: int, query: str) -> str:
     Context: {context}
 
     Question: {question}
-    """
+    """)
 
-    prompt = ChatPromptTemplate.from_template(template)
+# Number of distinct prompts whose answers are kept in memory
+ANSWER_CACHE_SIZE = 256
 
-    # 5. Build the LCEL Chain (The Pipeline)
-    
-    # Define a helper function to format the retrieved documents into a single string
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    # The LCEL Pipeline uses the pipe operator '|' for seamless data flow:
-    rag_chain = (
-        # 5a. RunnablePassthrough provides the initial input (the question)
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        # 5b. Pass the context and question to the prompt template
-        | prompt
-        # 5c. Pass the formatted prompt to the LLM
-        | llm
-        # 5d. Convert the LLM's structured output into a simple string
-        | StrOutputParser()
+
+@lru_cache(maxsize=1)
+def _get_llm() -> OllamaLLM:
+    # Define the LLM (The Generator) once per process and reuse its HTTP client
+    return OllamaLLM(
+        model="llama2", # <-- The model name you ran in the terminal
+        temperature=0.0
     )
 
-    # 6. Run the query using the final chain
-    # We use the key "question" because RunnablePassthrough takes the full input
-    answer = rag_chain.invoke(query) 
-    
-    return answer
+
+@lru_cache(maxsize=ANSWER_CACHE_SIZE)
+def _generate_answer(context: str, question: str) -> str:
+    """
+    Fills the prompt and calls the LLM directly (no runnable dispatch).
+    Cached on (context, question), i.e. the exact prompt: generation runs at temperature 0.
+    """
+    # OllamaLLM is a completion model: it takes the rendered prompt string and returns a str
+    return _get_llm().invoke(DOCUMENT_PROMPT.format(context=context, question=question))
+
+
+def query_document(document_id: int, query: str) -> str:
+    """
+    Runs RAG retrieval and generation as a plain retrieve -> prompt -> LLM call sequence.
+    """
+    # (CURRENTLY RAN OUT OF TOKEN. SWITCHED TO LOCAL EMBEDDING FROM HUGGINGFACE)
+    # embeddings = OpenAIEmbeddings()
+
+    # 1. Semantic search (Retrieval) over this document's chunks, cached per normalized query
+    # Retrieve more chunks and use MMR for diverse, relevant results
+    docs = search(query, k=8, where={"doc_id": int(document_id)}, mmr=True) # Retrieve top 8 with diversity
+    context = "\n\n".join(doc.page_content for doc in docs)
+
+    # 2. Generation, cached per prompt
+    return _generate_answer(context, query)
@@ -1,18 +1,56 @@
-import os
+import asyncio
+import hashlib
 import re
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+
 import praw
 import prawcore.exceptions
+from praw.models import MoreComments
+import requests
 from django.conf import settings
-from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from langchain_core.output_parsers import StrOutputParser
+from django.core.cache import cache
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_google_genai import ChatGoogleGenerativeAI
 
-# This directory will store your ChromaDB files (reuse from rag_service)
-CHROMA_DB_PATH = os.path.join(settings.BASE_DIR, "chroma_db")
+from .vector_service import add_text_batches, chunk_id, search
+
+# Matches /comments/{post_id} followed by "/", "?", "#" or the end of the URL
+# (Reddit post IDs are base36; they are returned lowercased)
+_POST_ID_RE = re.compile(r'/comments/([a-z0-9]+)(?=[/?#]|$)', re.IGNORECASE)
+_POST_ID_MARKER = "/comments/"
+_POST_ID_TERMINATORS = "/?#"
+_POST_ID_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789")
+
+# PII that can appear inside comment bodies: email addresses, phone numbers and
+# u/username mentions. One alternation, so a single pass redacts all three.
+# Phones must be shaped like one (3-3-4 digits, optional area-code parentheses and
+# country code), so years, ranges, counts and version numbers are left intact
+_PII_RE = re.compile(
+    r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b"
+    r"|(?<!\w)(?:\+\d{1,3}[\s.-]?)?(?:\(\d{3}\)|\d{3})[\s.-]?\d{3}[\s.-]?\d{4}\b"
+    r"|/?\bu/[A-Za-z0-9_-]+",
+    re.IGNORECASE,
+)
+
+# Comments are handed to the embedder in batches of this size
+COMMENT_BATCH_SIZE = 64
+
+
+@lru_cache(maxsize=1)
+def _get_reddit() -> praw.Reddit:
+    """
+    PRAW client, built once per process so its rate-limit state is reused.
+    An explicit requests.Session keeps TCP/TLS connections to Reddit alive between calls.
+    Call only after checking the credentials are configured.
+    """
+    return praw.Reddit(
+        client_id=settings.REDDIT_CLIENT_ID,
+        client_secret=settings.REDDIT_CLIENT_SECRET,
+        user_agent=settings.REDDIT_USER_AGENT,
+        requestor_kwargs={"session": requests.Session()}
+    )
 
 
 def extract_post_id_from_url(url: str) -> str:
@@ -22,15 +60,83 @@ def extract_post_id_from_url(url: str) -> str:
     - https://www.reddit.com/r/subreddit/comments/{post_id}/title/
     - https://reddit.com/r/subreddit/comments/{post_id}/title/
     - https://old.reddit.com/r/subreddit/comments/{post_id}/title/
+    - https://www.reddit.com/r/subreddit/comments/{post_id}?context=3
+    - https://www.reddit.com/r/subreddit/comments/{post_id}
     """
-    # Pattern to match /comments/{post_id}/
-    pattern = r'/comments/([a-zA-Z0-9]+)/'
-    match = re.search(pattern, url)
+    # Fast path: slice between the first "/comments/" and the next "/", "?", "#" or the end
+    start = url.find(_POST_ID_MARKER)
+    if start >= 0:
+        start += len(_POST_ID_MARKER)
+        end = len(url)
+        for terminator in _POST_ID_TERMINATORS:
+            index = url.find(terminator, start, end)
+            if index >= 0:
+                end = index
+        post_id = url[start:end].lower()
+        if post_id and _POST_ID_CHARS.issuperset(post_id):
+            return post_id
+
+    # Fallback for anything the slice doesn't cover (e.g. a later /comments/ segment)
+    match = _POST_ID_RE.search(url)
     if match:
-        return match.group(1)
+        return match.group(1).lower()
     raise ValueError(f"Could not extract post ID from URL: {url}")
 
 
+def _iter_comments(forest):
+    """
+    Walks a comment forest breadth-first (the same order as CommentForest.list()) without
+    materializing it, skipping any MoreComments placeholders. Uses an explicit queue,
+    so deep reply chains never hit the recursion limit.
+    """
+    pending = deque(forest)
+    while pending:
+        comment = pending.popleft()
+        if isinstance(comment, MoreComments):
+            continue
+        yield comment
+        pending.extend(comment.replies)
+
+
+def _comment_batches(submission, post_title: str, post_id: str):
+    """
+    Walks the comment tree lazily, filters it, and yields (ids, texts, metadatas) batches.
+    The comment listing is already in memory once the submission is loaded
+    (replace_more(limit=0) only drops MoreComments stubs), so there is no fetch to overlap.
+    """
+    # Flatten comment tree
+    try:
+        submission.comments.replace_more(limit=0)
+    except Exception as e:
+        raise ValueError(f"Failed to load comments: {str(e)}")
+
+    # Comments are filtered as the tree is walked, so short ones (minimum 50 characters)
+    # never get a row built
+    rows = (
+        (
+            # Keyed by (post, comment) so re-indexing skips comments that are already stored
+            chunk_id(f"{post_id}:{comment.id}"),
+            body,
+            {
+                # Handle deleted/removed authors. author is a lazy Redditor built from the
+                # listing; str() returns the name already parsed from it, so no author fetch
+                "author": str(author) if author else "[deleted]",
+                "score": comment.score or 0,
+                "source": post_title,
+                "post_id": post_id
+            },
+        )
+        for comment in _iter_comments(submission.comments)
+        for body in ((comment.body or "").strip(),)
+        if len(body) >= 50
+        for author in (comment.author,)
+    )
+
+    while batch := list(islice(rows, COMMENT_BATCH_SIZE)):
+        ids, texts, metadatas = zip(*batch)
+        yield list(ids), list(texts), list(metadatas)
+
+
 def index_reddit_post(url: str) -> dict:
     """
     Fetches Reddit post comments and indexes them into ChromaDB.
@@ -48,18 +154,14 @@ def index_reddit_post(url: str) -> dict:
     if not settings.REDDIT_CLIENT_ID or not settings.REDDIT_CLIENT_SECRET:
         raise ValueError("Reddit API credentials not configured. Please set REDDIT_CLIENT_ID and REDDIT_CLIENT_SECRET in .env file")
     
-    reddit = praw.Reddit(
-        client_id=settings.REDDIT_CLIENT_ID,
-        client_secret=settings.REDDIT_CLIENT_SECRET,
-        user_agent=settings.REDDIT_USER_AGENT
-    )
+    reddit = _get_reddit()
     
     # Fetch submission
     try:
         submission = reddit.submission(id=post_id)
         # Load submission attributes (title, etc.) - this triggers API call
-        _ = submission.title  # This triggers loading if not already loaded
-        if not submission.title:
+        post_title = submission.title  # Read once and passed down, so no later attribute lookups
+        if not post_title:
             raise ValueError("Submission has no title - may be deleted or inaccessible")
     except prawcore.exceptions.NotFound:
         raise ValueError(f"Reddit post with ID '{post_id}' not found. The post may have been deleted or the ID is invalid.")
@@ -70,79 +172,82 @@ def index_reddit_post(url: str) -> dict:
     except Exception as e:
         raise ValueError(f"Failed to fetch Reddit submission: {str(e)}. Check if the post ID is valid and accessible.")
     
-    # Flatten comment tree
-    try:
-        submission.comments.replace_more(limit=0)
-    except Exception as e:
-        raise ValueError(f"Failed to load comments: {str(e)}")
-    
-    # Filter and create documents
-    documents = []
-    for comment in submission.comments.list():
-        # Skip if comment doesn't have body attribute or body is None/empty
-        if not hasattr(comment, 'body') or not comment.body:
-            continue
-        
-        # Filter out short comments (minimum 50 characters)
-        comment_body = str(comment.body).strip()
-        if len(comment_body) >= 50:
-            # Handle deleted/removed authors
-            author_name = comment.author.name if comment.author else "[deleted]"
-            
-            # Create LangChain Document
-            doc = Document(
-                page_content=comment_body,
-                metadata={
-                    "author": author_name,
-                    "score": getattr(comment, 'score', 0),
-                    "source": submission.title,
-                    "post_id": submission.id
-                }
-            )
-            documents.append(doc)
+    # Embed and store comments batch by batch as the tree is walked
+    comment_count = add_text_batches(_comment_batches(submission, post_title, post_id))
     
-    if not documents:
+    if not comment_count:
         return {
             "status": "error",
             "error": "No comments found that meet the minimum length requirement (50 characters)"
         }
     
-    # Initialize embeddings
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    
-    # Store in ChromaDB
-    collection_name = f"reddit_{submission.id}"
-    
-    Chroma.from_documents(
-        documents,
-        embeddings,
-        collection_name=collection_name,
-        persist_directory=CHROMA_DB_PATH
-    )
-    
-    print(f"Indexed {len(documents)} comments for Reddit post: {submission.id}")
+    print(f"Indexed {comment_count} comments for Reddit post: {post_id}")
     
     return {
         "status": "success",
-        "post_title": submission.title,
-        "post_id": submission.id,
-        "comment_count": len(documents),
+        "post_title": post_title,
+        "post_id": post_id,
+        "comment_count": comment_count,
         "original_url": url  # Return original URL for attribution
     }
 
 
-def query_reddit_post(post_id: str, query: str, original_url: str = None) -> dict:
-    """
-    Queries indexed Reddit comments using RAG pipeline with Gemini.
-    Implements data anonymization and compliance features.
+# Prompt template with content guardrails
+REDDIT_PROMPT = ChatPromptTemplate.from_template("""
+    You are an impartial summarization assistant. Your sole purpose is to synthesize answers based only on the provided discussion comments.
     
-    Args:
-        post_id: Reddit post ID
-        query: User question
-        original_url: Original Reddit post URL for attribution
-        
-    Returns:
-        dict with 'answer', 'citations' (list of comment authors), and 'source_url'
+    CRITICAL SAFETY RULES:
+    - You must refuse to generate or summarize any content that promotes illegal activity, self-harm, hate speech, or harassment.
+    - If an answer cannot be generated safely or accurately from the provided comments, you must return a neutral error message: "The content necessary to answer this question is unavailable or violates safety guidelines."
+    - Base your answer ONLY on the provided comments. Do not add external knowledge or assumptions.
+    - If the comments do not contain enough information to answer the question, state that clearly.
+    
+    Context (Discussion Comments - anonymized):
+    {context}
+
+    Question: {question}
+    
+    Provide a clear, factual summary based solely on the comments above.
+    """)
+
+# Seconds a generated answer stays in the shared cache, keyed by the exact prompt
+# (generation runs at temperature 0, so the same prompt gives the same answer)
+ANSWER_CACHE_TTL = 24 * 60 * 60
+
+
+@lru_cache(maxsize=1)
+def _get_llm(model: str) -> ChatGoogleGenerativeAI:
+    """
+    Gemini client, built once per process so its HTTP/gRPC connection is reused.
+    """
+    # Initialize Gemini LLM with safety settings
+    # Note: LangChain's ChatGoogleGenerativeAI may not expose all safety settings
+    # We'll configure what's available and rely on prompt guardrails
+    try:
+        return ChatGoogleGenerativeAI(
+            model=model,
+            google_api_key=settings.GOOGLE_API_KEY,
+            temperature=0.0,
+            # Safety settings - these may vary by LangChain version
+            # The prompt will also enforce content safety
+        )
+    except Exception as e:
+        raise ValueError(f"Failed to initialize Gemini LLM. Check your GOOGLE_API_KEY and GOOGLE_GEMINI_MODEL settings. Error: {str(e)}")
+
+
+def _answer_cache_key(model: str, context: str, question: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model, context, question):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return f"rag:answer:{digest.hexdigest()}"
+
+
+def _retrieve_context(post_id: str, query: str) -> tuple[str, list]:
+    """
+    Validates the request, retrieves the post's most relevant comments and anonymizes them.
+    Returns (anonymized_context, unique_authors): only the context is sent to the LLM,
+    the authors are kept for attribution.
     """
     # Validate inputs
     if not post_id:
@@ -154,134 +259,87 @@ def query_reddit_post(post_id: str, query: str, original_url: str = None) -> dic
     if not settings.GOOGLE_API_KEY:
         raise ValueError("Google Gemini API key not configured. Please set GOOGLE_API_KEY in .env file")
     
-    # Initialize embeddings
-    try:
-        embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    except Exception as e:
-        raise ValueError(f"Failed to initialize embeddings: {str(e)}")
-    
-    collection_name = f"reddit_{post_id}"
-    
-    # Load the Vector Store and Create the Retriever
-    try:
-        vectorstore = Chroma(
-            collection_name=collection_name,
-            embedding_function=embeddings,
-            persist_directory=CHROMA_DB_PATH
-        )
-    except Exception as e:
-        raise ValueError(f"Failed to load ChromaDB collection '{collection_name}'. The post may not have been indexed yet. Error: {str(e)}")
-    
-    # Create retriever with k=10 (standard similarity search)
-    try:
-        retriever = vectorstore.as_retriever(
-            search_kwargs={"k": 10}
-        )
-    except Exception as e:
-        raise ValueError(f"Failed to create retriever: {str(e)}")
-    
     # Retrieve documents with metadata (for attribution)
     try:
-        # In newer LangChain versions, use invoke() instead of get_relevant_documents()
-        retrieved_docs = retriever.invoke(query)
+        # Standard similarity search with k=10 over this post's comments, cached per normalized query
+        retrieved_docs = search(query, k=10, where={"post_id": post_id})
         if not retrieved_docs:
-            raise ValueError(f"No relevant comments found for query. The post may not have enough indexed comments.")
+            raise ValueError(f"No relevant comments found for query. The post may not have been indexed yet or may not have enough indexed comments.")
     except ValueError:
         raise  # Re-raise ValueError as-is
     except Exception as e:
-        raise ValueError(f"Failed to retrieve documents: {str(e)}")
+        raise ValueError(f"Failed to retrieve documents for post '{post_id}': {str(e)}")
     
     # Anonymize data: strip PII before sending to LLM
-    # Keep mapping for attribution in final output
-    anonymized_comments = []
-    citation_mapping = []  # Store author info for attribution
-    
-    for i, doc in enumerate(retrieved_docs):
-        # Extract comment text only (no usernames, no metadata)
-        comment_text = doc.page_content.strip()
-        anonymized_comments.append(f"Comment {i+1}: {comment_text}")
-        
-        # Store author info separately for attribution (not sent to LLM)
-        author = doc.metadata.get("author", "[deleted]")
-        citation_mapping.append({
-            "author": author,
-            "comment_id": i+1
-        })
-    
-    # Initialize Gemini LLM with safety settings
-    # Note: LangChain's ChatGoogleGenerativeAI may not expose all safety settings
-    # We'll configure what's available and rely on prompt guardrails
-    try:
-        llm = ChatGoogleGenerativeAI(
-            model=settings.GOOGLE_GEMINI_MODEL,
-            google_api_key=settings.GOOGLE_API_KEY,
-            temperature=0.0,
-            # Safety settings - these may vary by LangChain version
-            # The prompt will also enforce content safety
-        )
-    except Exception as e:
-        raise ValueError(f"Failed to initialize Gemini LLM. Check your GOOGLE_API_KEY and GOOGLE_GEMINI_MODEL settings. Error: {str(e)}")
+    # Format anonymized comments: comment text only (no usernames, no metadata),
+    # with emails, phone numbers and user mentions in the text redacted
+    anonymized_context = "\n\n".join(
+        f"Comment {i+1}: {_PII_RE.sub('[REDACTED]', doc.page_content.strip())}"
+        for i, doc in enumerate(retrieved_docs)
+    )
     
-    # Define the prompt template with content guardrails
-    template = """
-    You are an impartial summarization assistant. Your sole purpose is to synthesize answers based only on the provided discussion comments.
+    # Keep mapping for attribution in final output: author info stored separately (not sent to LLM)
+    citation_mapping = [
+        {"author": doc.metadata.get("author", "[deleted]"), "comment_id": i+1}
+        for i, doc in enumerate(retrieved_docs)
+    ]
     
-    CRITICAL SAFETY RULES:
-    - You must refuse to generate or summarize any content that promotes illegal activity, self-harm, hate speech, or harassment.
-    - If an answer cannot be generated safely or accurately from the provided comments, you must return a neutral error message: "The content necessary to answer this question is unavailable or violates safety guidelines."
-    - Base your answer ONLY on the provided comments. Do not add external knowledge or assumptions.
-    - If the comments do not contain enough information to answer the question, state that clearly.
+    # Extract unique authors for citation, in retrieval order so the response is deterministic
+    unique_authors = list(dict.fromkeys(c["author"] for c in citation_mapping if c["author"] != "[deleted]"))
     
-    Context (Discussion Comments - anonymized):
-    {context}
+    return anonymized_context, unique_authors
 
-    Question: {question}
-    
-    Provide a clear, factual summary based solely on the comments above.
+
+def _gemini_error(e: Exception) -> ValueError:
+    # Classify a Gemini failure into a user-facing error
+    error_msg = str(e)
+    if "API key" in error_msg or "authentication" in error_msg.lower():
+        return ValueError(f"Gemini API authentication failed. Check your GOOGLE_API_KEY. Error: {error_msg}")
+    elif "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
+        return ValueError(f"Gemini API quota exceeded or rate limited. Please try again later. Error: {error_msg}")
+    else:
+        return ValueError(f"Failed to generate answer from Gemini API: {error_msg}")
+
+
+async def astream_reddit_post(post_id: str, query: str, original_url: str = None):
     """
-    
-    prompt = ChatPromptTemplate.from_template(template)
-    
-    # Format anonymized comments (no PII)
-    anonymized_context = "\n\n".join(anonymized_comments)
-    
-    # Build the LCEL Chain with anonymized context
-    # Create a simple function that returns the formatted context
-    def format_context(_):
-        return anonymized_context
-    
-    # Use RunnablePassthrough to pass query, and format context separately
-    rag_chain = (
-        {
-            "context": lambda _: anonymized_context,
-            "question": RunnablePassthrough()
+    Queries indexed Reddit comments using RAG pipeline with Gemini, streaming the answer.
+    Implements data anonymization and compliance features.
+    Retrieval and validation run (on a worker thread: Chroma and MiniLM are synchronous)
+    before this returns, so those errors raise immediately; the returned async generator
+    then yields {"delta": text} frames as Gemini produces tokens, and a final
+    {"citations": [...], "source_url": ...} frame (or an {"error": ...} frame).
+    Awaiting Gemini on the event loop means a slow generation holds no server thread.
+    A prompt answered before (by any process) is served from the shared cache as one delta.
+    """
+    anonymized_context, unique_authors = await asyncio.to_thread(_retrieve_context, post_id, query)
+    model = settings.GOOGLE_GEMINI_MODEL
+    cache_key = _answer_cache_key(model, anonymized_context, query)
+    messages = REDDIT_PROMPT.format_messages(context=anonymized_context, question=query)
+    llm = _get_llm(model)
+
+    async def frames():
+        try:
+            cached_answer = await cache.aget(cache_key)
+            if cached_answer is not None:
+                yield {"delta": cached_answer}
+            else:
+                parts = []
+                async for chunk in llm.astream(messages):
+                    if chunk.text:
+                        parts.append(chunk.text)
+                        yield {"delta": chunk.text}
+                answer = "".join(parts)
+                if not answer.strip():
+                    raise ValueError("Gemini API returned an empty response")
+                # Only complete answers are cached; a failed stream never reaches this point
+                await cache.aset(cache_key, answer, ANSWER_CACHE_TTL)
+        except Exception as e:
+            yield {"error": str(_gemini_error(e))}
+            return
+        yield {
+            "citations": unique_authors,
+            "source_url": original_url or f"https://www.reddit.com/comments/{post_id}/"
         }
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-    
-    # Run the query
-    try:
-        answer = rag_chain.invoke(query)
-        if not answer or not answer.strip():
-            raise ValueError("Gemini API returned an empty response")
-    except Exception as e:
-        error_msg = str(e)
-        if "API key" in error_msg or "authentication" in error_msg.lower():
-            raise ValueError(f"Gemini API authentication failed. Check your GOOGLE_API_KEY. Error: {error_msg}")
-        elif "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-            raise ValueError(f"Gemini API quota exceeded or rate limited. Please try again later. Error: {error_msg}")
-        else:
-            raise ValueError(f"Failed to generate answer from Gemini API: {error_msg}")
-    
-    # Prepare response with attribution
-    # Extract unique authors for citation
-    unique_authors = list(set([c["author"] for c in citation_mapping if c["author"] != "[deleted]"]))
-    
-    return {
-        "answer": answer,
-        "citations": unique_authors,
-        "source_url": original_url or f"https://www.reddit.com/comments/{post_id}/"
-    }
 
+    return frames()
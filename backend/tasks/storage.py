@@ -0,0 +1,24 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentHashStorage(FileSystemStorage):
+    """
+    Stores each upload under a hash of its bytes, so identical uploads share one file on disk.
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in content.chunks():
+            digest.update(chunk)
+
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest.hexdigest() + extension)
+
+        # Same bytes were uploaded before: reuse the stored file instead of writing a copy
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,40 @@
+from celery import shared_task
+
+from .models import Document
+from .rag_service import index_document, reuse_document_index
+from .reddit_service import index_reddit_post
+
+
+@shared_task
+def index_document_task(doc_id: int) -> int:
+    """
+    Runs the RAG ingestion pipeline for an uploaded Document in a Celery worker.
+    index_document flips 'is_indexed' to True once the vectors are stored,
+    so the frontend can poll the document to know when it is ready.
+    A failure is recorded in 'indexing_error' so the poll can stop and show it.
+    An upload with the same bytes as an indexed one reuses that document's vectors.
+    """
+    document_instance = Document.objects.get(pk=doc_id)
+    try:
+        source_doc_id = (
+            Document.objects.filter(uploaded_file=document_instance.uploaded_file.name, is_indexed=True)
+            .exclude(pk=doc_id)
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if source_doc_id is not None:
+            return reuse_document_index(source_doc_id, document_instance)
+        return index_document(document_instance)
+    except Exception as e:
+        Document.objects.filter(pk=doc_id).update(indexing_error=str(e) or type(e).__name__)
+        raise
+
+
+@shared_task
+def index_reddit_post_task(url: str) -> dict:
+    """
+    Fetches and indexes a Reddit post's comments in a Celery worker.
+    The returned dict (post_id, post_title, comment_count, ...) becomes the task result,
+    which the frontend reads from the task status endpoint.
+    """
+    return index_reddit_post(url)
@@ -1,3 +1,440 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import fitz
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from praw.models import MoreComments
+
+from . import reddit_service, vector_service
+from .models import Document
+from .rag_service import index_document, load_pdf_sections
+from .reddit_service import _PII_RE, _iter_comments, extract_post_id_from_url
+from .storage import ContentHashStorage
+from .tasks import index_document_task
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class FakeCollection:
+    """
+    In-memory stand-in for the Chroma collection: equality filters on metadata only.
+    """
+
+    def __init__(self):
+        self.rows = {}  # id -> (embedding, document, metadata)
+        self.added = []  # ids of every add() call, in order
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self.added.append(list(ids))
+        for row in zip(ids, embeddings, documents, metadatas):
+            self.rows.setdefault(row[0], row[1:])
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for row in zip(ids, embeddings, documents, metadatas):
+            self.rows[row[0]] = row[1:]
+
+    def get(self, ids=None, where=None, limit=None, include=()):
+        matched = [
+            (item_id, row) for item_id, row in self.rows.items()
+            if (ids is None or item_id in ids)
+            and all(row[2].get(field) == value for field, value in (where or {}).items())
+        ][:limit]
+        return {
+            "ids": [item_id for item_id, _ in matched],
+            "embeddings": [row[0] for _, row in matched],
+            "documents": [row[1] for _, row in matched],
+            "metadatas": [row[2] for _, row in matched],
+        }
+
+
+def redact(text: str) -> str:
+    return _PII_RE.sub("[REDACTED]", text)
+
+
+class PiiRedactionTests(SimpleTestCase):
+    def test_redacts_emails(self):
+        self.assertEqual(redact("mail a.b+c@example.co.uk today"), "mail [REDACTED] today")
+
+    def test_redacts_phone_numbers(self):
+        for phone in ["555-123-4567", "555.123.4567", "(555) 123-4567", "+1 (555) 123-4567", "+44 207 123 4567", "5551234567"]:
+            with self.subTest(phone=phone):
+                self.assertEqual(redact(f"call {phone} now"), "call [REDACTED] now")
+
+    def test_redacts_user_mentions(self):
+        self.assertEqual(redact("thanks u/Foo_bar and /u/baz-2"), "thanks [REDACTED] and [REDACTED]")
+
+    def test_keeps_numbers_that_are_not_phones(self):
+        for text in [
+            "years 2010 - 2015 were good",
+            "it was 100 200 300 times",
+            "from 1990 to 2020 2021",
+            "version 1.2.3.4.5.6",
+            "see the menu/item page",
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(redact(text), text)
+
+
+class ExtractPostIdTests(SimpleTestCase):
+    def test_fast_path_url_shapes(self):
+        for url in [
+            "https://www.reddit.com/r/python/comments/abc123/some_title/",
+            "https://old.reddit.com/r/python/comments/abc123/",
+            "https://www.reddit.com/r/python/comments/abc123",
+            "https://www.reddit.com/r/python/comments/abc123?context=3",
+            "https://www.reddit.com/r/python/comments/abc123#top",
+            "https://www.reddit.com/r/python/comments/ABC123/some_title/",
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(extract_post_id_from_url(url), "abc123")
+
+    def test_regex_fallback(self):
+        # First /comments/ segment is not an ID, so the slice fails and the regex finds the later one
+        url = "https://example.com/comments/not-an-id/r/python/comments/Abc123?utm_source=share"
+        self.assertEqual(extract_post_id_from_url(url), "abc123")
+
+    def test_rejects_urls_without_post_id(self):
+        for url in ["https://www.reddit.com/r/python/", "https://www.reddit.com/r/python/comments/"]:
+            with self.subTest(url=url):
+                with self.assertRaises(ValueError):
+                    extract_post_id_from_url(url)
+
+
+class ContentHashStorageTests(SimpleTestCase):
+    def test_same_bytes_reuse_existing_name(self):
+        with tempfile.TemporaryDirectory() as location:
+            storage = ContentHashStorage(location=location)
+            first = storage.save("documents/report.PDF", ContentFile(b"%PDF-1.4 same bytes"))
+            second = storage.save("documents/copy.pdf", ContentFile(b"%PDF-1.4 same bytes"))
+            other = storage.save("documents/other.pdf", ContentFile(b"%PDF-1.4 other bytes"))
+
+            self.assertEqual(first, second)
+            self.assertTrue(first.endswith(".pdf"))
+            self.assertNotEqual(first, other)
+            self.assertEqual(len(storage.listdir("documents")[1]), 2)
+
+
+def comment(name, *replies):
+    return SimpleNamespace(id=name, replies=list(replies))
+
+
+class IterCommentsTests(SimpleTestCase):
+    def test_breadth_first_and_skips_more_comments(self):
+        more = MoreComments.__new__(MoreComments)
+        forest = [
+            comment("a", comment("a1", comment("a1x")), more),
+            more,
+            comment("b", comment("b1")),
+        ]
+        self.assertEqual([c.id for c in _iter_comments(forest)], ["a", "b", "a1", "b1", "a1x"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DuplicateUploadTests(TestCase):
+    def test_identical_upload_embeds_no_new_chunks(self):
+        collection = FakeCollection()
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), \
+                mock.patch.object(vector_service, "get_collection", return_value=collection), \
+                mock.patch.object(vector_service, "embed_texts") as embed_texts:
+            first = Document.objects.create(
+                title="first", uploaded_file=ContentFile(b"%PDF-1.4 same bytes", name="first.pdf"), is_indexed=True
+            )
+            collection.add(
+                ids=["a", "b"],
+                embeddings=[[1.0, 0.0], [0.0, 1.0]],
+                documents=["Intro\nfirst chunk", "Intro\nsecond chunk"],
+                metadatas=[{"doc_id": first.id, "page": 1}, {"doc_id": first.id, "page": 2}],
+            )
+            second = Document.objects.create(
+                title="second", uploaded_file=ContentFile(b"%PDF-1.4 same bytes", name="second.pdf")
+            )
+            self.assertEqual(second.uploaded_file.name, first.uploaded_file.name)
+
+            self.assertEqual(index_document_task(second.id), 2)
+
+        embed_texts.assert_not_called()
+        second.refresh_from_db()
+        self.assertTrue(second.is_indexed)
+        copies = collection.get(where={"doc_id": second.id}, include=["metadatas"])
+        self.assertEqual(sorted(m["page"] for m in copies["metadatas"]), [1, 2])
+        self.assertEqual(len(collection.get(where={"doc_id": first.id})["ids"]), 2)
+
+
+BODY = "Body text that is long enough to make eleven points the most common font size here."
+
+
+def write_pdf(path, pages):
+    """
+    pages: one list of (baseline_y, font_size, text) per page.
+    """
+    with fitz.open() as pdf:
+        for lines in pages:
+            page = pdf.new_page()
+            for y, size, text in lines:
+                page.insert_text((72, y), text, fontsize=size)
+        pdf.save(path)
+
+
+class LoadPdfSectionsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "doc.pdf")
+
+    def test_section_paths_and_pages(self):
+        write_pdf(self.path, [
+            [
+                (72, 24, "Guide"),
+                (110, 11, BODY), (125, 11, BODY),
+                (170, 18, "Intro"),
+                (200, 11, BODY), (215, 11, BODY), (230, 11, BODY),
+            ],
+            [
+                # An empty heading followed by a separate one: paragraph spacing, not a wrap
+                (72, 18, "Setup"),
+                (132, 18, "Install"),
+                (170, 11, BODY), (185, 11, BODY),
+                # One heading wrapped over two lines (baselines 1.2 x font size apart)
+                (240, 18, "A heading long enough"),
+                (261.6, 18, "to wrap"),
+                (300, 11, BODY), (315, 11, BODY),
+            ],
+        ])
+
+        sections = load_pdf_sections(self.path)
+
+        self.assertEqual(
+            [(doc.metadata["section"], doc.metadata["page"]) for doc in sections],
+            [
+                ("Guide", 1),
+                ("Guide > Intro", 1),
+                ("Guide > Setup", 2),
+                ("Guide > Install", 2),
+                ("Guide > A heading long enough to wrap", 2),
+            ],
+        )
+        # The heading path leads the text; an empty heading still gets its own section
+        self.assertEqual(sections[1].page_content, "\n".join(["Guide > Intro", BODY, BODY, BODY]))
+        self.assertEqual(sections[2].page_content, "Guide > Setup")
+
+    def test_no_text_layer(self):
+        with fitz.open() as pdf:
+            pdf.new_page().draw_rect(fitz.Rect(72, 72, 200, 200))
+            pdf.save(self.path)
+
+        self.assertEqual(load_pdf_sections(self.path), [])
+        document = SimpleNamespace(id=1, uploaded_file=SimpleNamespace(path=self.path))
+        with self.assertRaises(ValueError):
+            index_document(document)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RetrievalCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.collection = FakeCollection()
+        for patcher in [
+            mock.patch.object(vector_service, "get_collection", return_value=self.collection),
+            mock.patch.object(vector_service, "_embed_query", return_value=np.array([1.0, 0.0], dtype=np.float32)),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        vector_service._cached_search.cache_clear()
+        self.addCleanup(vector_service._cached_search.cache_clear)
+        cache.clear()
+
+    def write(self, text, vector):
+        # What the Celery worker does: store the chunk, then bump the document's shared version
+        self.collection.add(ids=[text], embeddings=[vector], documents=[text], metadatas=[{"doc_id": 1}])
+        vector_service._bump_versions([{"doc_id": 1}])
+
+    def search(self):
+        return [doc.page_content for doc in vector_service.search("Question?", k=2, where={"doc_id": 1})]
+
+    def test_write_in_another_process_invalidates_cached_result(self):
+        self.write("first", [1.0, 0.0])
+        self.assertEqual(self.search(), ["first"])
+        self.assertEqual(self.search(), ["first"])
+
+        # Shares nothing with this process's lru_cache: only the collection and the shared cache
+        self.write("second", [0.6, 0.8])
+        self.assertEqual(self.search(), ["first", "second"])
+
+    def test_empty_result_is_not_cached(self):
+        self.assertEqual(self.search(), [])
+
+        self.write("first", [1.0, 0.0])
+        # The shared cache was reset (e.g. Redis restarted), so the version is back to 0
+        cache.clear()
+        self.assertEqual(self.search(), ["first"])
+
+
+def metadatas(count):
+    return [{"doc_id": 1}] * count
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AddTextBatchesTests(SimpleTestCase):
+    def setUp(self):
+        self.collection = FakeCollection()
+        self.embed_texts = mock.Mock(side_effect=lambda texts: np.zeros((len(texts), 2), dtype=np.float32))
+        for patcher in [
+            mock.patch.object(vector_service, "get_collection", return_value=self.collection),
+            mock.patch.object(vector_service, "embed_texts", self.embed_texts),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def embedded(self):
+        return [call.args[0] for call in self.embed_texts.call_args_list]
+
+    def test_repeated_ids_collapse_to_one(self):
+        count = vector_service.add_text_batches([
+            (["a", "b", "a"], ["A", "B", "A"], metadatas(3)),
+            (["b"], ["B again"], metadatas(1)),
+        ])
+        self.assertEqual(count, 2)
+        self.assertEqual(self.embedded(), [["A", "B"]])
+        self.assertEqual(self.collection.added, [["a", "b"]])
+
+    def test_stored_ids_are_never_embedded(self):
+        self.collection.add(ids=["a"], embeddings=[[1.0, 0.0]], documents=["A"], metadatas=metadatas(1))
+
+        count = vector_service.add_text_batches([(["a", "b"], ["A", "B"], metadatas(2))])
+        self.assertEqual(count, 2)
+        self.assertEqual(self.embedded(), [["B"]])
+
+    def test_shards_split_at_ingest_shard_size(self):
+        size = vector_service.INGEST_SHARD_SIZE
+        for total, shards in [(size, [size]), (2 * size + 1, [size, size, 1])]:
+            with self.subTest(total=total):
+                self.collection.rows.clear()
+                self.collection.added.clear()
+                self.embed_texts.reset_mock()
+                ids = [f"{total}-{i}" for i in range(total)]
+                # Batches of 100 never line up with the shard size
+                batches = ((ids[i:i + 100], ids[i:i + 100], metadatas(len(ids[i:i + 100]))) for i in range(0, total, 100))
+
+                self.assertEqual(vector_service.add_text_batches(batches), total)
+                self.assertEqual([len(texts) for texts in self.embedded()], shards)
+                self.assertEqual([len(added) for added in self.collection.added], shards)
+
+    def test_add_error_reaches_caller(self):
+        self.collection.add = mock.Mock(side_effect=RuntimeError("add failed"))
+        with self.assertRaisesMessage(RuntimeError, "add failed"):
+            vector_service.add_text_batches([(["a"], ["A"], metadatas(1))])
+
+    def test_add_error_is_not_lost_when_encoding_fails(self):
+        self.collection.add = mock.Mock(side_effect=RuntimeError("add failed"))
+        self.embed_texts.side_effect = [np.zeros((vector_service.INGEST_SHARD_SIZE, 2)), ValueError("encode failed")]
+        ids = [str(i) for i in range(vector_service.INGEST_SHARD_SIZE + 1)]
+        with self.assertRaisesMessage(RuntimeError, "add failed"):
+            vector_service.add_text_batches([(ids, ids, metadatas(len(ids)))])
+
+
+class CpuDtypeTests(SimpleTestCase):
+    def test_explicit_dtype(self):
+        with override_settings(EMBEDDING_DTYPE="float32"):
+            self.assertEqual(vector_service._cpu_dtype(), vector_service.CPU_DTYPES["float32"])
+
+    def test_invalid_dtype(self):
+        with override_settings(EMBEDDING_DTYPE="fp8"), self.assertRaises(ImproperlyConfigured):
+            vector_service._cpu_dtype()
+
+    def test_unset_falls_back_to_float32_without_native_bf16(self):
+        with override_settings(EMBEDDING_DTYPE=""), \
+                mock.patch.object(vector_service.torch.backends.mkldnn, "is_available", return_value=False):
+            self.assertEqual(vector_service._cpu_dtype(), vector_service.CPU_DTYPES["float32"])
+
+
+def fake_llm(*parts, error=None):
+    async def astream(messages):
+        for part in parts:
+            yield SimpleNamespace(text=part)
+        if error is not None:
+            raise error
+    return SimpleNamespace(astream=mock.Mock(side_effect=astream))
+
+
+class RedditQueryViewTests(SimpleTestCase):
+    url = "/api/reddit/query/"
+    context = "Comment 1: Use the stable release."
+    citations_frame = {"citations": ["alice"], "source_url": "https://www.reddit.com/comments/abc123/"}
+
+    def setUp(self):
+        self.cache = mock.Mock(aget=mock.AsyncMock(return_value=None), aset=mock.AsyncMock())
+        self.retrieve_context = mock.Mock(return_value=(self.context, ["alice"]))
+        for patcher in [
+            mock.patch.object(reddit_service, "cache", self.cache),
+            mock.patch.object(reddit_service, "_retrieve_context", self.retrieve_context),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def query(self, llm, **data):
+        with mock.patch.object(reddit_service, "_get_llm", return_value=llm):
+            response = await self.async_client.post(
+                self.url, {"post_id": "abc123", "query": "Which version?", **data}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            body = b"".join([chunk async for chunk in response.streaming_content])
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    async def test_rejects_bad_requests(self):
+        for body in ["not json", json.dumps({"post_id": "abc123"})]:
+            with self.subTest(body=body):
+                response = await self.async_client.post(self.url, body, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", json.loads(response.content))
+
+    async def test_retrieval_error_is_a_json_error(self):
+        self.retrieve_context.side_effect = ValueError("No relevant comments found")
+        response = await self.async_client.post(
+            self.url, {"post_id": "abc123", "query": "Which version?"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content)["details"], "No relevant comments found")
+
+    async def test_streams_deltas_then_citations_and_caches_answer(self):
+        frames = await self.query(fake_llm("Use ", "", "2.1"))
+
+        self.assertEqual(frames, [{"delta": "Use "}, {"delta": "2.1"}, self.citations_frame])
+        key = reddit_service._answer_cache_key(settings.GOOGLE_GEMINI_MODEL, self.context, "Which version?")
+        self.cache.aset.assert_awaited_once_with(key, "Use 2.1", reddit_service.ANSWER_CACHE_TTL)
+
+    async def test_cache_hit_is_one_delta(self):
+        self.cache.aget.return_value = "Use 2.1"
+        llm = fake_llm("never streamed")
+
+        frames = await self.query(llm, original_url="https://reddit.com/r/python/comments/abc123/")
+
+        self.assertEqual(frames, [
+            {"delta": "Use 2.1"},
+            {"citations": ["alice"], "source_url": "https://reddit.com/r/python/comments/abc123/"},
+        ])
+        llm.astream.assert_not_called()
+        self.cache.aset.assert_not_awaited()
+
+    async def test_failed_stream_ends_with_error_frame_and_is_not_cached(self):
+        frames = await self.query(fake_llm("Use ", error=RuntimeError("rate limit reached")))
+
+        self.assertEqual(frames[0], {"delta": "Use "})
+        self.assertEqual(len(frames), 2)
+        self.assertIn("rate limited", frames[1]["error"])
+        self.cache.aset.assert_not_awaited()
+
+    async def test_empty_stream_is_an_error_and_is_not_cached(self):
+        frames = await self.query(fake_llm("", "  "))
+
+        self.assertEqual(frames[0], {"delta": "  "})
+        self.assertEqual(len(frames), 2)
+        self.assertIn("empty response", frames[1]["error"])
+        self.cache.aset.assert_not_awaited()
@@ -0,0 +1,579 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import chromadb
+import numpy as np
+import torch
+import torch.nn.functional as F
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from filelock import FileLock
+from langchain_chroma import Chroma
+from langchain_chroma.vectorstores import maximal_marginal_relevance
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from transformers import AutoModel, AutoTokenizer
+
+# This directory will store your ChromaDB files when no Chroma server is configured
+CHROMA_DB_PATH = os.path.join(settings.BASE_DIR, "chroma_db")
+
+# Used for both indexing and querying so the vectors always live in the same space
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BATCH_SIZE = 128
+# MiniLM was trained with a 256 word-piece window; longer inputs are truncated
+EMBEDDING_MAX_LENGTH = 256
+# Accepted values of settings.EMBEDDING_DTYPE (CPU only)
+CPU_DTYPES = {"bfloat16": torch.bfloat16, "float32": torch.float32}
+
+# Int8-quantized ONNX export of the model used by the "onnx" backend.
+# Built at deploy time with `python manage.py export_onnx_embeddings`
+ONNX_MODEL_DIR = os.path.join(settings.BASE_DIR, "onnx_minilm_int8")
+ONNX_MODEL_FILE = "model_optimized_quantized.onnx"
+
+# Every PDF chunk and Reddit comment lives in this one collection, tagged with a
+# "doc_id" / "post_id" metadata field and filtered on it at query time, so a single
+# HNSW graph is kept warm instead of one per document
+COLLECTION = "rag_main"
+
+# HNSW settings applied when the collection is created (an existing collection keeps the
+# settings it was built with). Vectors are unit-normalized at encode time, so cosine ranks
+# exactly like inner product. M=24 / construction_ef=128 build a denser graph than Chroma's
+# defaults, and search_ef=100 widens the query-time beam for better recall at k=8-10.
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 128,
+    "hnsw:M": 24,
+    "hnsw:search_ef": 100,
+}
+
+# A filter matching at most this many chunks (a short document, a small thread) is
+# searched exactly with one matrix product instead of walking the filtered HNSW graph
+EXACT_SEARCH_THRESHOLD = 500
+# Candidates fetched for MMR re-ranking before diversifying down to k
+MMR_FETCH_K = 40
+
+# New chunks are embedded and written in shards of this size; writing one shard overlaps
+# with encoding the next, so ingest time approaches max(embed, add) instead of their sum
+INGEST_SHARD_SIZE = 256
+
+# Number of (filter, query) retrieval results kept in memory per process
+RETRIEVAL_CACHE_SIZE = 1024
+# Metadata fields search() filters on. Each value (e.g. doc_id=4) has a version counter in the
+# shared Django cache, bumped after every write of its chunks and made part of the retrieval
+# cache key, so a write in the Celery worker invalidates cached results in every web process
+VERSIONED_FIELDS = ("doc_id", "post_id")
+# Number of query embeddings kept in memory per process
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    The embedding model's tokenizer, loaded once per process (used to size chunks in tokens).
+    """
+    return AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+
+
+def _mean_pool(token_embeddings: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    # Mean pooling over real (non-padding) tokens, then L2-normalize, all in FP32
+    mask = attention_mask.unsqueeze(-1).float()
+    summed = (token_embeddings.float() * mask).sum(dim=1)
+    pooled = summed / mask.sum(dim=1).clamp(min=1e-9)
+    return F.normalize(pooled, p=2, dim=1)
+
+
+def _cpu_dtype() -> torch.dtype:
+    """
+    CPU precision from settings.EMBEDDING_DTYPE. When unset, BF16 is used only if oneDNN has
+    native BF16 kernels for this CPU (AVX512-BF16 or AMX); without them BF16 autocast is
+    emulated and slower than FP32.
+    """
+    if not settings.EMBEDDING_DTYPE:
+        try:
+            native_bf16 = torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        except (AttributeError, RuntimeError):
+            native_bf16 = False  # Older PyTorch without the capability check
+        return torch.bfloat16 if native_bf16 else torch.float32
+    if settings.EMBEDDING_DTYPE not in CPU_DTYPES:
+        raise ImproperlyConfigured(
+            f"EMBEDDING_DTYPE must be one of {', '.join(CPU_DTYPES)} (or unset), got '{settings.EMBEDDING_DTYPE}'."
+        )
+    return CPU_DTYPES[settings.EMBEDDING_DTYPE]
+
+
+class MiniLMEmbeddings(Embeddings):
+    """
+    LangChain Embeddings for MiniLM running in reduced precision.
+    Weights are loaded in FP16 on CUDA or settings.EMBEDDING_DTYPE on CPU (BF16 if the CPU supports it natively),
+    the forward pass runs under torch.autocast, and pooling/normalization happen in FP32.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.dtype = torch.float16 if self.device == "cuda" else _cpu_dtype()
+
+        self.tokenizer = get_tokenizer() if model_name == EMBEDDING_MODEL_NAME else AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name, torch_dtype=self.dtype).to(self.device).eval()
+        if self.device == "cpu" and self.dtype == torch.bfloat16:
+            # Optional: fuses ops and uses AVX-512 BF16 / AMX kernels on recent Xeons
+            try:
+                import intel_extension_for_pytorch as ipex
+                model = ipex.optimize(model, dtype=torch.bfloat16)
+            except ImportError:
+                pass
+        self.model = model
+
+    def _tokenize(self, texts: list[str]):
+        return self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=EMBEDDING_MAX_LENGTH,
+            return_tensors="pt",
+        ).to(self.device)
+
+    def _encode_batch(self, texts: list[str]) -> torch.Tensor:
+        inputs = self._tokenize(texts)
+        with torch.autocast(device_type=self.device, dtype=self.dtype, enabled=self.dtype != torch.float32):
+            token_embeddings = self.model(**inputs).last_hidden_state
+        return _mean_pool(token_embeddings, inputs["attention_mask"])
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """
+        Encodes texts into an (n, dim) numpy array of unit vectors.
+        Texts are sorted by token count first so each batch only pads to its own longest
+        sequence, then the vectors are scattered back to the caller's order.
+        """
+        if not texts:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+
+        # Bucket on word-piece counts rather than characters: padding is in tokens, and the
+        # fast tokenizer's unpadded pass costs little next to the forward pass
+        token_ids = self.tokenizer(
+            texts, truncation=True, max_length=EMBEDDING_MAX_LENGTH, return_attention_mask=False
+        )["input_ids"]
+        order = np.argsort([len(ids) for ids in token_ids], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        # No autograd bookkeeping: these tensors never need gradients
+        with torch.inference_mode():
+            batches = [
+                self._encode_batch(sorted_texts[start:start + self.batch_size]).cpu().numpy()
+                for start in range(0, len(sorted_texts), self.batch_size)
+            ]
+        return np.concatenate(batches)[np.argsort(order)]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([text])[0].tolist()
+
+
+class DynamicBatchMiniLMEmbeddings(MiniLMEmbeddings):
+    """
+    Coalesces concurrent encode() calls from different threads (request threads, Celery
+    thread-pool tasks) into shared batches, so a GPU runs one large forward pass instead of
+    many small ones. Calls are collected for up to settings.EMBEDDING_BATCH_TIMEOUT_MS.
+    Requires the optional 'batched' package.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, batch_size: int = EMBEDDING_BATCH_SIZE):
+        import batched
+
+        super().__init__(model_name, batch_size)
+        self._encode_coalesced = batched.dynamically(
+            batch_size=batch_size,
+            timeout_ms=settings.EMBEDDING_BATCH_TIMEOUT_MS,
+        )(self._encode_rows)
+
+    def _encode_rows(self, texts: list[str]) -> list[np.ndarray]:
+        return list(super().encode(texts))
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return super().encode(texts)
+        return np.stack(self._encode_coalesced(texts))
+
+
+class OnnxMiniLMEmbeddings(MiniLMEmbeddings):
+    """
+    MiniLM exported to ONNX with dynamic int8 quantization, run through ONNX Runtime's
+    CPU execution provider (VNNI int8 dot products on Cascade Lake and newer Xeons).
+    The ONNX export and quantization come from the 'optimum-onnx' package.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, batch_size: int = EMBEDDING_BATCH_SIZE):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+        self.batch_size = batch_size
+        self.device = "cpu"
+        self.tokenizer = get_tokenizer() if model_name == EMBEDDING_MODEL_NAME else AutoTokenizer.from_pretrained(model_name)
+        if not os.path.exists(os.path.join(ONNX_MODEL_DIR, ONNX_MODEL_FILE)):
+            # Exporting here would make the first request (or every Celery child at once) pay for it
+            raise ImproperlyConfigured(
+                f"ONNX embedding model not found in {ONNX_MODEL_DIR}. "
+                "Run 'python manage.py export_onnx_embeddings' or set EMBEDDING_BACKEND=torch."
+            )
+        # ONNX Runtime keeps its own thread pools (all cores by default) and ignores
+        # torch.set_num_threads, so apply the same per-process cap here
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = settings.TORCH_NUM_THREADS
+        session_options.inter_op_num_threads = 1
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            ONNX_MODEL_DIR, file_name=ONNX_MODEL_FILE, session_options=session_options
+        )
+
+    def _encode_batch(self, texts: list[str]) -> torch.Tensor:
+        inputs = self._tokenize(texts)
+        token_embeddings = self.model(**inputs).last_hidden_state
+        return _mean_pool(token_embeddings, inputs["attention_mask"])
+
+
+def export_quantized_onnx(model_name: str = EMBEDDING_MODEL_NAME, save_dir: str = ONNX_MODEL_DIR, force: bool = False) -> bool:
+    """
+    Exports the model to ONNX, applies ONNX Runtime's O3 graph optimizations
+    (attention/LayerNorm fusion, GELU approximation) and writes a dynamically
+    int8-quantized copy to save_dir. Returns False if it already existed (and not force).
+    The result is built in a temporary sibling directory and renamed into place under a
+    file lock, so concurrent exports never overlap and readers never see a partial model.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoOptimizationConfig, AutoQuantizationConfig
+
+    save_dir = os.path.abspath(save_dir)
+    parent = os.path.dirname(save_dir)
+    with FileLock(save_dir + ".lock"):
+        if not force and os.path.exists(os.path.join(save_dir, ONNX_MODEL_FILE)):
+            return False
+
+        with tempfile.TemporaryDirectory() as export_dir, tempfile.TemporaryDirectory() as optimized_dir, \
+                tempfile.TemporaryDirectory(dir=parent) as staging_dir:
+            ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(export_dir)
+            ORTOptimizer.from_pretrained(export_dir).optimize(
+                save_dir=optimized_dir,
+                optimization_config=AutoOptimizationConfig.O3(),
+            )
+            quantizer = ORTQuantizer.from_pretrained(optimized_dir, file_name="model_optimized.onnx")
+            quantized_dir = os.path.join(staging_dir, "model")
+            quantizer.quantize(
+                save_dir=quantized_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False),
+            )
+            # Same filesystem as save_dir, so the swap is a rename
+            if os.path.exists(save_dir):
+                shutil.rmtree(save_dir)
+            os.replace(quantized_dir, save_dir)
+    return True
+
+
+def create_embeddings() -> MiniLMEmbeddings:
+    """
+    Builds the embedding model selected by settings.EMBEDDING_BACKEND ('onnx' or 'torch').
+    The torch backend can additionally coalesce concurrent calls (settings.EMBEDDING_DYNAMIC_BATCHING).
+    """
+    if settings.EMBEDDING_BACKEND == "onnx":
+        return OnnxMiniLMEmbeddings()
+    if settings.EMBEDDING_DYNAMIC_BATCHING:
+        return DynamicBatchMiniLMEmbeddings()
+    return MiniLMEmbeddings()
+
+
+# Process-wide singletons, created lazily on first use so each worker loads
+# the model weights and opens the Chroma store and collection only once. The lock keeps
+# two request threads from loading them concurrently in a threaded server; it is
+# re-entrant because the collection/vectorstore getters build on get_chroma_client().
+_EMBEDDINGS = None
+_CHROMA_CLIENT = None
+_COLLECTION = None
+_VECTORSTORE = None
+_SINGLETON_LOCK = threading.RLock()
+
+
+def get_embeddings() -> MiniLMEmbeddings:
+    global _EMBEDDINGS
+    if _EMBEDDINGS is None:
+        with _SINGLETON_LOCK:
+            if _EMBEDDINGS is None:
+                _EMBEDDINGS = create_embeddings()
+    return _EMBEDDINGS
+
+
+def get_chroma_client():
+    """
+    Connects to the Chroma server at settings.CHROMA_HOST when one is configured, so HNSW
+    indexes stay warm in the server instead of being loaded into every Django/Celery process.
+    Falls back to an embedded store under CHROMA_DB_PATH for local development.
+    """
+    global _CHROMA_CLIENT
+    if _CHROMA_CLIENT is None:
+        with _SINGLETON_LOCK:
+            if _CHROMA_CLIENT is None:
+                if settings.CHROMA_HOST:
+                    _CHROMA_CLIENT = chromadb.HttpClient(host=settings.CHROMA_HOST, port=settings.CHROMA_PORT)
+                else:
+                    _CHROMA_CLIENT = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    return _CHROMA_CLIENT
+
+
+def get_collection():
+    """
+    The shared rag_main collection handle, created with COLLECTION_METADATA if missing.
+    """
+    global _COLLECTION
+    if _COLLECTION is None:
+        with _SINGLETON_LOCK:
+            if _COLLECTION is None:
+                _COLLECTION = get_chroma_client().get_or_create_collection(COLLECTION, metadata=COLLECTION_METADATA)
+    return _COLLECTION
+
+
+def get_vectorstore() -> Chroma:
+    """
+    LangChain wrapper around the shared collection, reused by every HNSW query.
+    """
+    global _VECTORSTORE
+    if _VECTORSTORE is None:
+        with _SINGLETON_LOCK:
+            if _VECTORSTORE is None:
+                _VECTORSTORE = Chroma(
+                    client=get_chroma_client(),
+                    collection_name=COLLECTION,
+                    embedding_function=get_embeddings(),
+                    collection_metadata=COLLECTION_METADATA,
+                )
+    return _VECTORSTORE
+
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """
+    Encodes every text in one batched pass and returns an (n, dim) numpy array.
+    """
+    return get_embeddings().encode(texts)
+
+
+def chunk_id(key: str) -> str:
+    """
+    Deterministic ID for a chunk (hash of its text, or of any stable key), so re-indexing
+    the same content never double-inserts and already-stored chunks can be skipped.
+    """
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def add_documents(documents, ids: list[str] = None) -> int:
+    """
+    Embeds LangChain Documents up front and writes them to the Chroma collection
+    instead of letting Chroma embed them batch by batch.
+    Returns the number of unique chunks now stored for these documents.
+    """
+    return add_texts(
+        [doc.page_content for doc in documents],
+        [doc.metadata for doc in documents],
+        ids,
+    )
+
+
+def add_texts(texts: list[str], metadatas: list[dict], ids: list[str] = None) -> int:
+    """
+    Same as add_documents, for callers that already hold parallel texts/metadatas lists.
+    IDs default to the hash of each text.
+    """
+    if ids is None:
+        ids = [chunk_id(text) for text in texts]
+    return add_text_batches([(ids, texts, metadatas)])
+
+
+def add_text_batches(batches) -> int:
+    """
+    Embeds (ids, texts, metadatas) batches as the iterable yields them, so a slow
+    producer (e.g. a network fetch) overlaps with encoding.
+    IDs already stored in the collection are skipped before embedding, which makes
+    re-indexing unchanged content almost free. New chunks are written in shards of
+    INGEST_SHARD_SIZE, and each shard's add() runs on a writer thread while the next
+    shard is being encoded. Returns the number of unique IDs seen.
+    """
+    collection = get_collection()
+
+    seen = set()
+    pending = []  # (id, text, metadata) not embedded yet
+    written = 0
+    last_write = None
+
+    def store(ids, vectors, texts, metadatas):
+        # Passed as the float32 array itself: no per-float Python objects
+        collection.add(ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+        # Results cached before this shard landed (possibly a half-indexed document) go stale
+        _bump_versions(metadatas)
+
+    def wait_for_last_write():
+        nonlocal last_write
+        if last_write is not None:
+            previous, last_write = last_write, None
+            previous.result()
+
+    def write_shard(shard):
+        nonlocal last_write
+        texts = [text for _, text, _ in shard]
+        vectors = embed_texts(texts)
+        # Only now wait for the previous add(), which ran while this shard was encoding
+        wait_for_last_write()
+        last_write = writer.submit(
+            store,
+            [item_id for item_id, _, _ in shard],
+            vectors,
+            texts,
+            [metadata for _, _, metadata in shard],
+        )
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        try:
+            for batch_ids, batch_texts, batch_metadatas in batches:
+                # Repeated IDs (e.g. identical page headers) collapse to one entry
+                fresh = []
+                for item_id, text, metadata in zip(batch_ids, batch_texts, batch_metadatas):
+                    if item_id not in seen:
+                        seen.add(item_id)
+                        fresh.append((item_id, text, metadata))
+                if not fresh:
+                    continue
+
+                existing = set(collection.get(ids=[item_id for item_id, _, _ in fresh], include=[])["ids"])
+                pending.extend(item for item in fresh if item[0] not in existing)
+                while len(pending) >= INGEST_SHARD_SIZE:
+                    shard, pending = pending[:INGEST_SHARD_SIZE], pending[INGEST_SHARD_SIZE:]
+                    write_shard(shard)
+                    written += len(shard)
+
+            if pending:
+                write_shard(pending)
+                written += len(pending)
+        finally:
+            # Also when encoding or the producer failed: the add() still in flight may have failed too
+            wait_for_last_write()
+
+    print(f"Embedded {written} new of {len(seen)} chunks")
+    return len(seen)
+
+
+def copy_chunks(source_where: dict, overrides: dict, make_id) -> int:
+    """
+    Stores a copy of every chunk matching source_where with overrides applied to its metadata
+    (e.g. a new doc_id), reusing the stored embeddings instead of encoding the texts again.
+    make_id(text) gives each copy's ID. Returns the number of chunks copied.
+    """
+    collection = get_collection()
+    rows = collection.get(where=source_where, include=["embeddings", "documents", "metadatas"])
+    if not rows["ids"]:
+        return 0
+    metadatas = [{**metadata, **overrides} for metadata in rows["metadatas"]]
+    collection.upsert(
+        ids=[make_id(text) for text in rows["documents"]],
+        embeddings=rows["embeddings"],
+        documents=rows["documents"],
+        metadatas=metadatas,
+    )
+    _bump_versions(metadatas)
+    return len(rows["ids"])
+
+
+def normalize_query(query: str) -> str:
+    # MiniLM's tokenizer is uncased, so case and extra whitespace never change the embedding
+    return " ".join(query.lower().split())
+
+
+def _version_key(field: str, value) -> str:
+    return f"rag:version:{field}={value}"
+
+
+def _bump_versions(metadatas: list[dict]) -> None:
+    """
+    Increments the shared version of every doc_id/post_id present in the written metadatas.
+    """
+    keys = {_version_key(field, metadata[field]) for metadata in metadatas for field in VERSIONED_FIELDS if field in metadata}
+    for key in keys:
+        cache.add(key, 0, timeout=None)  # No-op if the counter exists; incr() needs the key
+        cache.incr(key)
+
+
+def _filter_version(where: dict) -> tuple:
+    """
+    Current versions of the versioned fields in a filter, read from the shared cache.
+    """
+    versioned = [_version_key(field, value) for field, value in sorted(where.items()) if field in VERSIONED_FIELDS]
+    versions = cache.get_many(versioned)
+    return tuple(versions.get(key, 0) for key in versioned)
+
+
+@lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def _embed_query(model_key: str, query: str) -> np.ndarray:
+    """
+    Query embedding, cached per normalized query. Unlike retrieval results it does not depend
+    on the collection contents, so a repeated question skips the forward pass for any post/document.
+    """
+    vector = get_embeddings().encode([query])[0]
+    vector.setflags(write=False)  # Shared between callers
+    return vector
+
+
+def _exact_search(collection, where: dict, query_vector: np.ndarray, k: int, mmr: bool) -> list:
+    """
+    Brute-force retrieval over every chunk matching the filter (exact, no graph walk).
+    """
+    rows = collection.get(where=where, include=["embeddings", "documents", "metadatas"])
+    vectors = np.asarray(rows["embeddings"], dtype=np.float32)
+    # Unit vectors: the dot product is the cosine similarity
+    top = np.argsort(-(vectors @ query_vector), kind="stable")[:MMR_FETCH_K if mmr else k]
+    if mmr:
+        top = top[maximal_marginal_relevance(query_vector, vectors[top], k=k)]
+    return [Document(page_content=rows["documents"][i], metadata=rows["metadatas"][i]) for i in top]
+
+
+class _EmptyResult(Exception):
+    """Raised inside the cached search so empty results are never cached (lru_cache skips exceptions)."""
+
+
+@lru_cache(maxsize=RETRIEVAL_CACHE_SIZE)
+def _cached_search(model_key: str, where: tuple, version: tuple, query: str, k: int, mmr: bool) -> tuple:
+    # version only keys the cache: a write to the filtered chunks changes it, so older results are never hit again
+    where = dict(where)
+    collection = get_collection()
+    matched = collection.get(where=where, limit=EXACT_SEARCH_THRESHOLD + 1, include=[])["ids"]
+    if not matched:
+        # Nothing indexed yet (the Celery worker may still be on it). Not cached: if the shared
+        # cache is reset the versions restart at 0, and a cached miss would then outlive the write
+        raise _EmptyResult
+
+    query_vector = _embed_query(model_key, query)
+    if len(matched) <= EXACT_SEARCH_THRESHOLD:
+        return tuple(_exact_search(collection, where, query_vector, k, mmr))
+
+    vectorstore = get_vectorstore()
+    if mmr:
+        docs = vectorstore.max_marginal_relevance_search_by_vector(
+            query_vector.tolist(), k=k, fetch_k=MMR_FETCH_K, filter=where
+        )
+    else:
+        docs = vectorstore.similarity_search_by_vector(query_vector.tolist(), k=k, filter=where)
+    return tuple(docs)
+
+
+def search(query: str, k: int, where: dict, mmr: bool = False) -> list:
+    """
+    Retrieves the top-k LangChain Documents matching a metadata filter
+    (e.g. {"doc_id": 4}), cached per (filter, filter version, normalized query).
+    The embedding model is part of the cache key so switching models never serves stale hits.
+    """
+    model_key = f"{EMBEDDING_MODEL_NAME}:{settings.EMBEDDING_BACKEND}"
+    try:
+        return list(_cached_search(
+            model_key, tuple(sorted(where.items())), _filter_version(where), normalize_query(query), k, mmr
+        ))
+    except _EmptyResult:
+        return []
@@ -1,5 +1,12 @@
 # backend/tasks/views.py
 
+import json
+
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status, viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
@@ -7,9 +14,10 @@ from rest_framework.authentication import SessionAuthentication, BasicAuthentica
 from rest_framework.parsers import MultiPartParser, FormParser # <-- NEW Import
 from .document_serializers import DocumentSerializer
 from .models import Document
-from .rag_service import index_document
 from rest_framework.views import APIView
-from .rag_service import index_document, query_document
+from .rag_service import query_document
+from .tasks import index_document_task, index_reddit_post_task
+from celery.result import AsyncResult
 
 
 class DocumentViewSet(viewsets.ModelViewSet):
@@ -25,43 +33,42 @@ class DocumentViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer) -> None:
         # 1. Save the document (This is the file upload and database record creation)
-        self.document_instance = serializer.save()
-        
-        # 2. Run indexing on the saved document instance
-        # This will update the instance's 'is_indexed' field inside rag_service.py
-        self.chunk_count = index_document(self.document_instance)
-        
-        # REMOVED BUG: The line 'document_instance = serializer.save()' was duplicated here.
+        # 'is_indexed' stays False until the background worker finishes ingestion
+        self.document_instance = serializer.save(is_indexed=False)
+
+        # 2. Queue indexing on a Celery worker once the row is committed,
+        # so the upload request returns without waiting on parse + embed
+        document_id = self.document_instance.id
+        transaction.on_commit(lambda: index_document_task.delay(document_id))
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         try:
-            self.perform_create(serializer)  # Runs the saving and indexing logic
+            self.perform_create(serializer)  # Saves the upload and queues indexing
         except Exception as exc:
-            # Clean up the uploaded file if indexing failed
+            # Clean up the uploaded file if the indexing task could not be queued
             if hasattr(self, "document_instance"):
                 self.document_instance.delete()
             return Response(
                 {
-                    "error": "Indexing failed. Check API key/file format or file integrity.",
+                    "error": "Could not queue indexing. Check that the Celery broker is running.",
                     "details": str(exc),
                 },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-        # Ensure the final response uses the data saved/modified in perform_create
+        # Ensure the final response uses the data saved in perform_create
         final_response_data = self.get_serializer(self.document_instance).data
         headers = self.get_success_headers(final_response_data)
         
         return Response(
             {
                 **final_response_data, # Use the freshly serialized instance data
-                "status": "Indexing started successfully",
-                "chunks": getattr(self, "chunk_count", None),
+                "status": "Indexing started. Poll this document until 'is_indexed' is true.",
             },
-            status=status.HTTP_201_CREATED,
+            status=status.HTTP_202_ACCEPTED,
             headers=headers,
         )
     
@@ -82,7 +89,31 @@ class QueryDocumentView(APIView):
             )
 
         try:
-            # Call the LCEL-based RAG service to get the generated answer
+            document_id = int(document_id)
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "'document_id' must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        document = Document.objects.filter(pk=document_id).only("is_indexed", "indexing_error").first()
+        if document is None:
+            return Response(
+                {"error": f"Document {document_id} not found"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if not document.is_indexed:
+            # Querying now would search an empty or half-written index
+            return Response(
+                {
+                    "error": "Document indexing failed" if document.indexing_error else "Document is still being indexed",
+                    "details": document.indexing_error,
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+
+        try:
+            # Call the RAG service to get the generated answer
             answer = query_document(document_id, query)
             
             return Response(
@@ -113,60 +144,95 @@ class RedditIndexView(APIView):
             )
 
         try:
-            from .reddit_service import index_reddit_post
-            result = index_reddit_post(url)
-            
-            if result.get("status") == "error":
-                return Response(
-                    result,
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            return Response(
-                result,
-                status=status.HTTP_200_OK
-            )
+            from .reddit_service import extract_post_id_from_url
+            # Reject malformed URLs right away instead of in the worker
+            post_id = extract_post_id_from_url(url)
         except ValueError as e:
             # Invalid URL format
             return Response(
                 {"error": "Invalid Reddit URL", "details": str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+        try:
+            # Fetching, embedding and storing the comments runs on a Celery worker;
+            # the client polls /api/tasks/<task_id>/ for the result
+            task = index_reddit_post_task.delay(url)
         except Exception as e:
-            # This catches PRAW errors, ChromaDB errors, etc.
             return Response(
-                {"error": "Indexing failed", "details": str(e)},
+                {
+                    "error": "Could not queue indexing. Check that the Celery broker is running.",
+                    "details": str(e),
+                },
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        return Response(
+            {"task_id": task.id, "status": "pending", "post_id": post_id},
+            status=status.HTTP_202_ACCEPTED
+        )
+
 
-class RedditQueryView(APIView):
-    """View for querying indexed Reddit comments."""
+class TaskStatusView(APIView):
+    """View for polling a background indexing task."""
     permission_classes = [AllowAny]
 
-    def post(self, request, format=None):
+    def get(self, request, task_id, format=None):
+        result = AsyncResult(task_id)
+        data = {"task_id": task_id, "state": result.state}
+
+        if result.successful():
+            data["result"] = result.result
+        elif result.failed():
+            # The task raised: surface the exception message (e.g. post not found)
+            data["error"] = str(result.result)
+
+        return Response(data, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class RedditQueryView(View):
+    """
+    View for querying indexed Reddit comments.
+    A native async Django view: run under ASGI (uvicorn) the Gemini stream is awaited on
+    the event loop, so concurrent queries don't each hold a worker thread. Under WSGI
+    (runserver) Django buffers the whole answer before sending it.
+    """
+
+    async def post(self, request):
         # Expecting JSON: {"post_id": "abc123", "query": "What do users think?", "original_url": "https://..."}
-        post_id = request.data.get('post_id')
-        query = request.data.get('query')
-        original_url = request.data.get('original_url')
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "Request body must be JSON"}, status=status.HTTP_400_BAD_REQUEST)
+
+        post_id = data.get('post_id')
+        query = data.get('query')
+        original_url = data.get('original_url')
 
         if not post_id or not query:
-            return Response(
+            return JsonResponse(
                 {"error": "Missing 'post_id' or 'query'"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         try:
-            from .reddit_service import query_reddit_post
-            result = query_reddit_post(post_id, query, original_url)
-            
-            return Response(
-                result,  # Returns dict with answer, citations, source_url
-                status=status.HTTP_200_OK
-            )
+            from .reddit_service import astream_reddit_post
+            # Retrieval happens here; generation happens while the response streams
+            frames = await astream_reddit_post(post_id, query, original_url)
         except Exception as e:
-            # This catches LLM errors, ChromaDB errors, etc.
-            return Response(
+            # This catches validation, API key and ChromaDB errors
+            return JsonResponse(
                 {"error": "Query failed", "details": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+        # NDJSON: one {"delta": ...} line per generated chunk, then a final line
+        # with citations and source_url (or {"error": ...} if generation fails)
+        response = StreamingHttpResponse(
+            (json.dumps(frame) + "\n" async for frame in frames),
+            content_type="application/x-ndjson",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # Stop nginx from buffering the stream
+        return response
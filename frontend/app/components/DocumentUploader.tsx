@@ -5,6 +5,9 @@ import axios from 'axios';
 
 // Set your Django API base URL
 const API_BASE_URL = 'http://127.0.0.1:8000/api/';
+const INDEX_POLL_INTERVAL_MS = 2000;
+// Give up polling after this long (e.g. no Celery worker is running)
+const INDEX_POLL_TIMEOUT_MS = 10 * 60 * 1000;
 
 const DocumentUploader = () => {
   const [file, setFile] = useState<File | null>(null);
@@ -21,7 +24,8 @@ const DocumentUploader = () => {
     }
 
     setLoading(true);
-    setMessage('Indexing document... This may take a moment.');
+    setDocumentId(null);
+    setMessage('Uploading document...');
 
     // 1. Use FormData for file uploads
     const formData = new FormData();
@@ -37,12 +41,27 @@ const DocumentUploader = () => {
         },
       });
 
-      // 3. Handle successful response
-      const data = response.data;
-      setDocumentId(data.id);
-      setMessage(
-        `Success! Document ID ${data.id} indexed (${data.chunks} chunks).`,
-      );
+      // 3. Indexing runs in the background: poll the document until it is indexed or failed
+      const uploadedId = response.data.id;
+      setMessage(`Document ID ${uploadedId} uploaded. Indexing is running in the background...`);
+
+      const deadline = Date.now() + INDEX_POLL_TIMEOUT_MS;
+      let doc = response.data;
+      while (!doc.is_indexed && !doc.indexing_error) {
+        if (Date.now() > deadline) {
+          setMessage(`Document ID ${uploadedId} is still not indexed. Check that the Celery worker is running.`);
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, INDEX_POLL_INTERVAL_MS));
+        doc = (await axios.get(`${API_BASE_URL}documents/${uploadedId}/`)).data;
+      }
+
+      if (doc.indexing_error) {
+        setMessage(`Indexing failed for Document ID ${uploadedId}: ${doc.indexing_error}`);
+      } else {
+        setDocumentId(uploadedId);
+        setMessage(`Success! Document ID ${uploadedId} is indexed.`);
+      }
     } catch (error) {
       console.error('Upload Error:', error);
       setMessage('Upload failed. Check console for details.');
@@ -33,9 +33,15 @@ const RAGQuery = () => {
       // 2. Display the final answer
       setAnswer(response.data.answer); 
 
-    } catch (error) {
+    } catch (error: any) {
       console.error('Query Error:', error);
-      setAnswer('Query failed. Ensure your Django server and Ollama are running.');
+      // 409: the document is still being indexed, or indexing failed
+      const data = error.response?.data;
+      setAnswer(
+        data?.error
+          ? `${data.error}${data.details ? `: ${data.details}` : ''}`
+          : 'Query failed. Ensure your Django server and Ollama are running.',
+      );
     } finally {
       setLoading(false);
     }
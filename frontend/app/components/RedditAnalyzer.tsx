@@ -4,6 +4,11 @@ import React, { useState, FormEvent } from 'react';
 import axios from 'axios';
 
 const API_BASE_URL = 'http://127.0.0.1:8000/api/';
+const TASK_POLL_INTERVAL_MS = 1000;
+// Stop polling after this many attempts: Celery reports PENDING forever when no worker is running
+const TASK_POLL_MAX_ATTEMPTS = 300;
+// Celery's ready states: the task will not change state again
+const TASK_READY_STATES = ['SUCCESS', 'FAILURE', 'REVOKED'];
 
 const RedditAnalyzer = () => {
   const [url, setUrl] = useState<string>('');
@@ -42,14 +47,28 @@ const RedditAnalyzer = () => {
         },
       });
 
-      if (response.data.status === 'success') {
-        setPostId(response.data.post_id);
-        setPostTitle(response.data.post_title);
-        setCommentCount(response.data.comment_count);
-        setOriginalUrl(response.data.original_url || url);
-        setStatus(`Successfully indexed ${response.data.comment_count} comments from "${response.data.post_title}"`);
+      // Indexing runs in a background worker: poll the task until it finishes
+      const taskId = response.data.task_id;
+      let task = (await axios.get(`${API_BASE_URL}tasks/${taskId}/`)).data;
+      for (let attempt = 1; !TASK_READY_STATES.includes(task.state); attempt++) {
+        if (attempt >= TASK_POLL_MAX_ATTEMPTS) {
+          setStatus('Error: Indexing did not finish in time. Check that the Celery worker is running.');
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, TASK_POLL_INTERVAL_MS));
+        task = (await axios.get(`${API_BASE_URL}tasks/${taskId}/`)).data;
+      }
+
+      if (task.state === 'REVOKED') {
+        setStatus('Error: Indexing was cancelled');
+      } else if (task.state === 'SUCCESS' && task.result?.status === 'success') {
+        setPostId(task.result.post_id);
+        setPostTitle(task.result.post_title);
+        setCommentCount(task.result.comment_count);
+        setOriginalUrl(task.result.original_url || url);
+        setStatus(`Successfully indexed ${task.result.comment_count} comments from "${task.result.post_title}"`);
       } else {
-        setStatus(`Error: ${response.data.error || 'Indexing failed'}`);
+        setStatus(`Error: ${task.error || task.result?.error || 'Indexing failed'}`);
       }
     } catch (error: any) {
       console.error('Indexing Error:', error);
@@ -69,29 +88,61 @@ const RedditAnalyzer = () => {
     setStatus('');
 
     try {
-      const response = await axios.post(`${API_BASE_URL}reddit/query/`, {
-        post_id: postId,
-        query: query,
-        original_url: originalUrl,
-      }, {
+      // The answer streams back as NDJSON: {"delta"} lines, then {"citations", "source_url"}
+      const response = await fetch(`${API_BASE_URL}reddit/query/`, {
+        method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
+        body: JSON.stringify({
+          post_id: postId,
+          query: query,
+          original_url: originalUrl,
+        }),
       });
 
-      setAnswer(response.data.answer);
-      setCitations(response.data.citations || []);
-      setSourceUrl(response.data.source_url || null);
+      if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.error && data.details ? `${data.error}: ${data.details}` : data.error || `Request failed with status ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      let streamedAnswer = '';
+
+      const handleFrame = (line: string) => {
+        if (!line.trim()) return;
+        const frame = JSON.parse(line);
+        if (frame.error) {
+          throw new Error(frame.error);
+        }
+        if (frame.delta) {
+          streamedAnswer += frame.delta;
+          setAnswer(streamedAnswer);
+        }
+        if (frame.citations) {
+          setCitations(frame.citations);
+          setSourceUrl(frame.source_url || null);
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop() ?? '';
+        lines.forEach(handleFrame);
+      }
+      handleFrame(buffered);
+
       setStatus('Insight generated successfully!');
     } catch (error: any) {
       console.error('Query Error:', error);
-      const errorMessage = error.response?.data?.error || error.response?.data?.details || error.message || 'Query failed. Ensure your Django server and Gemini API are configured.';
+      const errorMessage = error.message || 'Query failed. Ensure your Django server and Gemini API are configured.';
       setAnswer('');
       setStatus(`Error: ${errorMessage}`);
-      // Log full error for debugging
-      if (error.response?.data) {
-        console.error('Full error response:', error.response.data);
-      }
     } finally {
       setLoading(false);
     }